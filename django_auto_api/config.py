@@ -10,6 +10,13 @@ DEFAULT_CONFIG = {
     # Extra apps to skip (app labels), even if INCLUDE_APPS is None
     "EXCLUDE_APPS": [],
 
+    # Client-side rate limits for concurrent generation. Set these to your
+    # account's requests-per-minute / tokens-per-minute quota; the scan
+    # paces itself instead of bursting into 429s. (Defaults match a typical
+    # gpt-4o-mini tier.)
+    "OPENAI_RPM": 500,
+    "OPENAI_TPM": 200_000,
+
     # Later you can add stuff like:
     # "OPENAI_MODEL": "gpt-4o-mini",
 }
@@ -1,14 +1,44 @@
 # django_auto_api/management/commands/autoapi_scan.py
+import asyncio
+import functools
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 from django.core.management.base import BaseCommand
 from django.apps import apps as django_apps
 
 from django_auto_api.config import get_config
-from django_auto_api.llm_client import generate_code, OpenAIConfigError
+from django_auto_api.llm_client import (
+    build_batch_line,
+    cache_lookup,
+    estimate_tokens,
+    generate_code_aiohttp,
+    generate_code_async,
+    poll_batch,
+    submit_batch,
+    OpenAIBatchError,
+    OpenAIConfigError,
+    RateLimiter,
+)
 from django_auto_api.prompts import build_serializer_prompt
 
 
+@functools.lru_cache(maxsize=None)
+def _collect_fields(model):
+    """
+    (name, type) pairs for every concrete field of a model, skipping
+    auto-created reverse relations. Cached per model class — _meta.get_fields()
+    is not free inside Django, and a scan may hit the same model repeatedly.
+    """
+    return tuple(
+        (field.name, type(field).__name__)
+        for field in model._meta.get_fields()
+        if not (getattr(field, "auto_created", False) and not field.concrete)
+    )
+
+
 class Command(BaseCommand):
     help = (
         "Scan installed apps and list their models, then optionally use OpenAI to "
@@ -42,6 +72,39 @@ class Command(BaseCommand):
             action="store_true",
             help="Only show estimated token usage and API cost, do not call OpenAI.",
         )
+        parser.add_argument(
+            "--max-concurrency",
+            type=int,
+            default=8,
+            help="Maximum number of OpenAI requests in flight at once (default: 8).",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Do not read or write the local prompt → code cache.",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Ignore cached responses and re-generate (cache is updated).",
+        )
+        parser.add_argument(
+            "--use-aiohttp",
+            action="store_true",
+            help=(
+                "Call the OpenAI API over aiohttp instead of the default "
+                "httpx transport (scales better past ~50 concurrent requests; "
+                "requires the 'aiohttp' package)."
+            ),
+        )
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            help=(
+                "Use the OpenAI Batch API instead of real-time requests "
+                "(50%% cheaper, completes within 24h)."
+            ),
+        )
 
     def handle(self, *args, **options):
         cfg = get_config()
@@ -52,33 +115,20 @@ class Command(BaseCommand):
         budget_only = options.get("budget_only")
 
         include_apps = cfg.get("INCLUDE_APPS")
-        exclude_apps = set(cfg.get("EXCLUDE_APPS") or [])
+        include_set = frozenset(include_apps) if include_apps else None
+        exclude_set = frozenset(cfg.get("EXCLUDE_APPS") or [])
 
         self.stdout.write(self.style.NOTICE("🔍 Scanning installed apps...\n"))
 
-        # Collect app configs (skip contrib by default)
-        all_app_configs = [
+        # One pass over the app configs: skip contrib, apply the
+        # INCLUDE_APPS / EXCLUDE_APPS settings and the --app CLI filter.
+        app_configs = [
             app
             for app in django_apps.get_app_configs()
             if not app.name.startswith("django.contrib")
-        ]
-
-        # Apply INCLUDE_APPS filter from settings (if provided)
-        if include_apps:
-            include_set = set(include_apps)
-            app_configs = [app for app in all_app_configs if app.label in include_set]
-        else:
-            app_configs = all_app_configs
-
-        # Apply --app CLI filter
-        if app_label_filter:
-            app_configs = [
-                app for app in app_configs if app.label == app_label_filter
-            ]
-
-        # Remove excluded apps
-        app_configs = [
-            app for app in app_configs if app.label not in exclude_apps
+            and (include_set is None or app.label in include_set)
+            and app.label not in exclude_set
+            and (app_label_filter is None or app.label == app_label_filter)
         ]
 
         if not app_configs:
@@ -99,7 +149,12 @@ class Command(BaseCommand):
 
             total_apps += 1
             total_models += len(models)
-            app_models_map[app_config] = models
+            # Introspect fields once here, while we're already touching each
+            # model; the generation phase reuses these instead of walking
+            # _meta again. (_collect_fields is cached per model class.)
+            app_models_map[app_config] = [
+                (model, _collect_fields(model)) for model in models
+            ]
 
             self.stdout.write(self.style.SUCCESS(f"App: {app_config.label}"))
             if models:
@@ -125,9 +180,18 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.WARNING("No models found, nothing to estimate."))
                 return
 
-            # Rough estimate: ~1000 tokens per model (prompt + output)
-            avg_tokens_per_model = 1000
-            total_tokens = total_models * avg_tokens_per_model
+            # Estimate per model from its actual prompt (field count matters:
+            # a 50-field model costs far more than a 2-field one). Uses
+            # tiktoken when installed, chars/4 otherwise.
+            total_tokens = sum(
+                estimate_tokens(
+                    build_serializer_prompt(
+                        app_config.label, model.__name__, fields
+                    )
+                )
+                for app_config, model_entries in app_models_map.items()
+                for model, fields in model_entries
+            )
 
             # Example pricing: gpt-4o-mini ≈ $0.0009 per 1K tokens (input+output combined rough)
             price_per_1k = 0.0009
@@ -159,80 +223,241 @@ class Command(BaseCommand):
                 return
 
         # ---- Generation phase ----
-        for app_config, models in app_models_map.items():
-            self._generate_for_app(app_config, models, model_name_filter)
+        # Collect every (app, model, prompt) up front, then run all OpenAI
+        # calls concurrently: N models finish in roughly max(latency) instead
+        # of sum(latency), since the work is purely network-bound.
+        tasks = []
+        for app_config, model_entries in app_models_map.items():
+            for model, fields in model_entries:
+                model_name = model.__name__
+
+                if model_name_filter and model_name != model_name_filter:
+                    continue
 
-        self.stdout.write(self.style.SUCCESS("\n✅ Serializer generation complete."))
+                prompt = build_serializer_prompt(
+                    app_config.label, model_name, fields
+                )
+                tasks.append((app_config, model_name, prompt))
 
-    def _generate_for_app(self, app_config, models, model_name_filter=None):
-        app_label = app_config.label
-        app_path = Path(app_config.path)
+        if not tasks:
+            self.stdout.write(self.style.WARNING("No models matched, nothing to generate."))
+            return
 
-        serializers_file = app_path / "api_serializers_ai.py"
+        if options["batch"]:
+            self._generate_via_batch(tasks)
+            return
 
-        # Ensure file header exists (only once)
-        if not serializers_file.exists():
-            serializers_file.write_text(
-                "from rest_framework import serializers\n\n",
-                encoding="utf-8",
-            )
+        # Coalesce identical prompts (models sharing the same field list,
+        # e.g. empty stubs) onto a single request; every (app, model) pair
+        # that shared the prompt fans out from the one result.
+        unique_prompts = list(dict.fromkeys(prompt for (_a, _m, prompt) in tasks))
 
-        for model in models:
-            model_name = model.__name__
+        self.stdout.write(
+            self.style.NOTICE(
+                f"🤖 Generating serializers for {len(tasks)} models "
+                f"({len(unique_prompts)} unique prompts, "
+                f"up to {options['max_concurrency']} concurrent requests)..."
+            )
+        )
 
-            if model_name_filter and model_name != model_name_filter:
+        results = asyncio.run(
+            self._run_all(
+                unique_prompts,
+                options["max_concurrency"],
+                rpm=cfg["OPENAI_RPM"],
+                tpm=cfg["OPENAI_TPM"],
+                use_aiohttp=options["use_aiohttp"],
+                use_cache=not options["no_cache"],
+                refresh=options["refresh"],
+            )
+        )
+        result_by_prompt = dict(zip(unique_prompts, results))
+
+        # Group results per app (in the deterministic order tasks were
+        # collected), then write each app's file in one go.
+        to_write = {}
+        for app_config, model_name, prompt in tasks:
+            result = result_by_prompt[prompt]
+            if isinstance(result, OpenAIConfigError):
+                # No API key configured → every task failed the same way,
+                # print the hint once and stop.
+                self.stdout.write(self.style.ERROR(str(result)))
+                return
+            if isinstance(result, Exception):
+                self.stdout.write(
+                    self.style.ERROR(f"OpenAI error for {model_name}: {result}")
+                )
                 continue
 
-            # Collect field metadata
-            fields_meta = []
-            for field in model._meta.get_fields():
-                # Skip reverse relations / auto-created stuff
-                if getattr(field, "auto_created", False) and not field.concrete:
-                    continue
-                fields_meta.append(
-                    {
-                        "name": field.name,
-                        "type": field.__class__.__name__,
-                    }
+            if not result.strip():
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"No code returned for {app_config.label}.{model_name}, skipping."
+                    )
                 )
+                continue
 
-            prompt = build_serializer_prompt(app_label, model_name, fields_meta)
+            to_write.setdefault(app_config, []).append((model_name, result))
 
-            self.stdout.write(
-                self.style.NOTICE(
-                    f"🤖 Generating serializer for {app_label}.{model_name}..."
-                )
+        self._write_all(to_write)
+
+        self.stdout.write(self.style.SUCCESS("\n✅ Serializer generation complete."))
+
+    def _generate_via_batch(self, tasks):
+        """
+        Send all prompts through the OpenAI Batch API: write a JSONL request
+        file, upload it, then poll until results come back and dispatch each
+        one to its app by custom_id.
+        """
+        by_custom_id = {}
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".jsonl", encoding="utf-8", delete=False
+        ) as f:
+            jsonl_path = f.name
+            for app_config, model_name, prompt in tasks:
+                custom_id = f"{app_config.label}.{model_name}"
+                by_custom_id[custom_id] = (app_config, model_name)
+                f.write(build_batch_line(custom_id, prompt) + "\n")
+
+        self.stdout.write(
+            self.style.NOTICE(
+                f"📦 Submitting batch with {len(tasks)} requests..."
             )
+        )
 
-            try:
-                code = generate_code(prompt)
-            except OpenAIConfigError as e:
-                self.stdout.write(self.style.ERROR(str(e)))
-                return
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f"OpenAI error for {model_name}: {e}")
-                )
-                continue
+        try:
+            batch_id = submit_batch(jsonl_path)
+            self.stdout.write(f"  Batch id: {batch_id} (polling until complete)")
+            results = poll_batch(batch_id)
+        except OpenAIConfigError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+            return
+        except OpenAIBatchError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+            return
 
+        to_write = {}
+        for custom_id, (app_config, model_name) in by_custom_id.items():
+            code = results.get(custom_id, "")
             if not code.strip():
                 self.stdout.write(
                     self.style.WARNING(
-                        f"No code returned for {app_label}.{model_name}, skipping."
+                        f"No code returned for {custom_id}, skipping."
                     )
                 )
                 continue
+            to_write.setdefault(app_config, []).append((model_name, code))
 
-            # Append generated serializer
-            with serializers_file.open("a", encoding="utf-8") as f:
-                f.write(code)
-                if not code.endswith("\n"):
-                    f.write("\n")
-                f.write("\n\n")
+        self._write_all(to_write)
 
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"  ✅ Wrote serializer for {app_label}.{model_name} "
-                    f"to {serializers_file}"
+        self.stdout.write(self.style.SUCCESS("\n✅ Serializer generation complete."))
+
+    async def _run_all(
+        self,
+        prompts,
+        max_concurrency,
+        rpm,
+        tpm,
+        use_aiohttp=False,
+        use_cache=True,
+        refresh=False,
+    ):
+        """
+        Run one generate call per (deduplicated) prompt, at most
+        max_concurrency in flight at once and paced against the configured
+        RPM/TPM quota. Returns results in prompt order; per-prompt errors
+        come back as exception instances instead of raising.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        limiter = RateLimiter(rpm=rpm, tpm=tpm)
+        generate = generate_code_aiohttp if use_aiohttp else generate_code_async
+
+        async def _one(prompt):
+            # Cache hits cost no quota, so check before taking limiter
+            # capacity away from real requests.
+            if use_cache and not refresh:
+                cached = cache_lookup(prompt)
+                if cached is not None:
+                    return cached
+            async with semaphore:
+                await limiter.acquire(estimate_tokens(prompt))
+                return await generate(prompt, use_cache=use_cache, refresh=refresh)
+
+        return await asyncio.gather(
+            *[_one(prompt) for prompt in prompts],
+            return_exceptions=True,
+        )
+
+    def _write_all(self, to_write):
+        """
+        Write every app's serializer file from a small thread pool — the
+        per-app writes are independent disk I/O, so overlapping them hides
+        each other's latency. Errors are reported with their app label.
+        """
+        if not to_write:
+            return
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = {
+                pool.submit(self._write_app_file, app_config, entries): (
+                    app_config,
+                    entries,
                 )
+                for app_config, entries in to_write.items()
+            }
+            for future in as_completed(futures):
+                app_config, entries = futures[future]
+                try:
+                    serializers_file = future.result()
+                except OSError as e:
+                    self.stdout.write(
+                        self.style.ERROR(
+                            f"Failed to write serializers for {app_config.label}: {e}"
+                        )
+                    )
+                    continue
+                for model_name, _code in entries:
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f"  ✅ Wrote serializer for {app_config.label}.{model_name} "
+                            f"to {serializers_file}"
+                        )
+                    )
+
+    def _write_app_file(self, app_config, entries):
+        """
+        Append all generated serializers for one app through a single file
+        handle and a single write, instead of an open/close syscall pair
+        per model. entries: [(model_name, code), ...] in generation order.
+        Returns the path written to.
+        """
+        app_path = Path(app_config.path)
+        serializers_file = app_path / "api_serializers_ai.py"
+
+        # Ensure file header exists (only once). O_CREAT|O_EXCL creates the
+        # file and writes the header in one syscall round-trip — no exists()
+        # stat probe, which matters on networked filesystems.
+        try:
+            fd = os.open(
+                str(serializers_file),
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                0o644,
             )
+        except FileExistsError:
+            pass
+        else:
+            os.write(fd, b"from rest_framework import serializers\n\n")
+            os.close(fd)
+
+        parts = []
+        for _model_name, code in entries:
+            parts.append(code)
+            if not code.endswith("\n"):
+                parts.append("\n")
+            parts.append("\n\n")
+
+        # Append all generated serializers at once
+        with serializers_file.open("a", encoding="utf-8", buffering=64 * 1024) as f:
+            f.write("".join(parts))
+
+        return serializers_file
@@ -1,37 +1,34 @@
 # django_auto_api/prompts.py
-from typing import List, Dict
+from typing import Iterable, Tuple
+
+
+# Bound .format of a module-level template: the skeleton is built once at
+# import instead of re-assembled per call, so build_serializer_prompt only
+# pays for interpolating the variable parts (called once per model).
+#
+# The prompt is deliberately minimal — just the model identity and its
+# fields. The task description and output rules live in the constant
+# system message (llm_client.SYSTEM_PROMPT), which costs input tokens
+# once per request instead of ~100 tokens of boilerplate per model here.
+_TEMPLATE = "{app_label}.{model_name}\n{fields_lines}".format
 
 
 def build_serializer_prompt(
     app_label: str,
     model_name: str,
-    fields: List[Dict[str, str]],
+    fields: Iterable[Tuple[str, str]],
 ) -> str:
     """
-    Build a user prompt that describes the model and asks for a DRF ModelSerializer.
-    fields: [{ "name": "title", "type": "CharField" }, ...]
+    Build the compact user prompt for one model: 'app_label.ModelName'
+    plus one '- name: type' line per field.
+    fields: (name, type) pairs, e.g. [("title", "CharField"), ...]
     """
     fields_lines = "\n".join(
-        f"- {f['name']}: {f['type']}" for f in fields
+        f"- {name}: {type_name}" for name, type_name in fields
     )
 
-    return f"""
-You are given a Django model definition.
-
-App label: {app_label}
-Model name: {model_name}
-
-Fields:
-{fields_lines}
-
-Task:
-Write a Django REST Framework ModelSerializer named {model_name}Serializer for this model.
-
-Rules:
-- Import from rest_framework import serializers.
-- Use serializers.ModelSerializer.
-- Define Meta.model = {model_name}.
-- Set Meta.fields = "__all__".
-- Do NOT include any explanation or comments.
-- Output ONLY valid Python code that can be appended to a serializers module.
-"""
+    return _TEMPLATE(
+        app_label=app_label,
+        model_name=model_name,
+        fields_lines=fields_lines,
+    )